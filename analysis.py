@@ -20,27 +20,186 @@ Guess structure:
     guess:      what the user guessed, either 'left' or 'right'
     guess_time: how long the user took, in seconds (with double precision)
 
+Guesses are held in memory as guess.Guess records and written in the
+structure above.
+
+Record format:
+    save_results writes each run as one line of two JSON documents separated
+    by a tab (which compact JSON never contains):
+        summary:    version (RECORD_VERSION), pain_level, num_images,
+                    test_items, start_time, duration (total guess_time),
+                    guesses (number of guesses) and cube, a list of
+                    [type, side, correct, count, total guess_time]
+        detail:     {"guess_log": [...]}
+    RunAnalysis decodes the detail only when a guess is actually needed.
+    Lines holding a single result structure (version 1) are still read.
 """
 
 import argparse
+import collections
 import csv
 import datetime
+import glob
+import gzip
+import hashlib
+import heapq
+import itertools
 import json
+import multiprocessing
+import operator
 import os
+import sys
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+import guess
+import segments
+import sketch
 
 TIME_FMT = "%d %b %Y %H:%M:%S"
 
+DETAILED_HEADERS = ['timestamp', 'image_id', 'image', 'type', 'side', 'time',
+                    'correct', 'guess', 'guess_time']
+DETAILED_MODES = ('split', 'single', 'gzip')
+EXPORT_BUFSIZE = 1 << 20
+EXPORT_PREFETCH = 4
+
+DIST_QUANTILES = (0.5, 0.9, 0.99)
+
+FOLLOW_INTERVAL = 1.0
+
+MERGE_CHUNK = 32
+MERGE_PREFETCH = 2
+MERGE_WINDOW = 256
+
+RECORD_VERSION = 2
+RECORD_SEP = '\t'
+_SUMMARY_KEYS = ('pain_level', 'num_images', 'test_items', 'start_time')
+
+_guess_fields = operator.attrgetter('image_id', 'image', 'type', 'side',
+                                    'time', 'correct', 'guess', 'guess_time')
+
 def ts2dt(ts):
     return datetime.datetime.fromtimestamp(ts)
 
+def date2ts(date):
+    "parses YYYY-MM-DD as the unix timestamp of local midnight"
+    return time.mktime(datetime.datetime.strptime(date, "%Y-%m-%d").timetuple())
+
+_ANY = object()
+
+def _cube_aggregate(cube, type=None, side=None, correct=_ANY):
+    "returns (count, total guess_time) of the matching cells of `cube`"
+    count, total = 0, 0
+    for (t, s, c), (n, secs) in cube.items():
+        if type is not None and t != type:
+            continue
+        if side is not None and s != side:
+            continue
+        if correct is not _ANY and c != correct:
+            continue
+        count += n
+        total += secs
+    return count, total
+
+def _cube_of(guesses):
+    """count and sum guess_time of every guess, in one pass, indexed by
+    (type, side, correct)"""
+    cube = {}
+    for item in guesses:
+        key = (item.type, item.side, item.correct)
+        cell = cube.get(key)
+        if cell is None:
+            cell = cube[key] = [0, 0]
+        cell[0] += 1
+        cell[1] += item.guess_time or 0
+    return cube
+
+def _cube_to_list(cube):
+    return [[t, s, c, n, secs] for (t, s, c), (n, secs) in cube.items()]
+
+def _cube_from_list(cells):
+    return dict(((t, s, c), [n, secs]) for t, s, c, n, secs in cells)
+
 class RunAnalysis(object):
     def __init__(self, line=None):
         self._data = None
+        self._detail = None
+        self._cube = {}
+        self._fingerprint = None
         if line is not None:
             self.load_from_str(line)
 
     def load_from_str(self, string):
-        self._data = json.loads(string)
+        head, sep, detail = string.partition(RECORD_SEP)
+        data = json.loads(head)
+        if not sep:
+            self._data = data
+            self._detail = None
+            self._data['guess_log'] = [guess.Guess.from_dict(d)
+                                       for d in self._data['guess_log']]
+            self._cube = _cube_of(self._data['guess_log'])
+            return
+        if data.get('version') != RECORD_VERSION:
+            raise ValueError("unsupported record version %r" % (
+                data.get('version'),))
+        self._data = dict((k, data[k]) for k in _SUMMARY_KEYS)
+        self._data['guess_log'] = None
+        self._detail = detail
+        self._cube = _cube_from_list(data['cube'])
+
+    def _guesses(self):
+        "the guess_log, decoding the record's detail section on first use"
+        if self._data['guess_log'] is None:
+            self._data['guess_log'] = [guess.Guess.from_dict(d) for d in
+                                       json.loads(self._detail)['guess_log']]
+            self._detail = None
+        return self._data['guess_log']
+
+    def _filter(self, filters):
+        "returns the guesses matching every key=value in `filters`"
+        filters = list(filters.items())
+        return [i for i in self._guesses()
+                if all(getattr(i, k) == v for k, v in filters)]
+
+    def _aggregate(self, type=None, side=None, **filters):
+        """returns (count, total guess_time) of the matching guesses; answered
+        from the cube unless filtering on something other than type, side
+        and correct"""
+        correct = filters.pop('correct', _ANY)
+        if filters:
+            if type is not None:
+                filters['type'] = type
+            if side is not None:
+                filters['side'] = side
+            if correct is not _ANY:
+                filters['correct'] = correct
+            items = self._filter(filters)
+            return len(items), sum(i.guess_time or 0 for i in items)
+        return _cube_aggregate(self._cube, type, side, correct)
+
+    def cube(self):
+        "{(type, side, correct): [count, total guess_time]}"
+        return self._cube
+
+    def summary_key(self):
+        """hashable key of the run's start_time and totals, taken without
+        decoding the detail of a record"""
+        return (self.start(), self.pain_level(), self.count(), self.kinds(),
+                frozenset((k, tuple(v)) for k, v in self._cube.items()))
+
+    def fingerprint(self):
+        "hash of the run's content, independent of key order and spacing"
+        if self._fingerprint is None:
+            self._guesses()
+            text = json.dumps(self._data, sort_keys=True, separators=(',', ':'),
+                              default=guess.to_json)
+            self._fingerprint = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return self._fingerprint
 
     def start(self):
         return self._data['start_time']
@@ -55,32 +214,29 @@ class RunAnalysis(object):
         return self._data['pain_level']
 
     def items(self):
-        return self._data['guess_log'][:]
+        return self._guesses()[:]
 
     def correct_items(self):
-        return [i for i in self._data['guess_log'] if i['correct']]
+        return [i for i in self._guesses() if i.correct]
 
     def correct(self):
-        return len(self.correct_items())
+        return self._aggregate(correct=True)[0]
+
+    def duration(self):
+        return self._aggregate()[1]
 
     def values_of(self, log_key, **filters):
-        items = self._data['guess_log']
-        for k,v in filters.items():
-            items = [i for i in items if i[k] == v]
-        return [i[log_key] for i in items]
+        return [getattr(i, log_key) for i in self._filter(filters)]
 
     def accuracy(self):
         return self.correct() * 1.0 / self.count()
 
     def count_of(self, type=None, side=None, **filters):
-        items = self._data['guess_log']
-        if type is not None:
-            items = [i for i in items if i['type'] == type]
-        if side is not None:
-            items = [i for i in items if i['side'] == side]
-        for k,v in filters.items():
-            items = [i for i in items if i[k] == v]
-        return len(items)
+        return self._aggregate(type, side, **filters)[0]
+
+    def time_of(self, type=None, side=None, **filters):
+        "total guess_time of the matching guesses"
+        return self._aggregate(type, side, **filters)[1]
 
     def accuracy_of(self, type=None, side=None, **filters):
         items = self.count_of(type, side, **filters)
@@ -89,150 +245,782 @@ class RunAnalysis(object):
             return float('nan')
         return num * 1.0 / items
 
+class Summary(object):
+    "totals over many runs, built by adding up their cubes"
+    def __init__(self):
+        self._runs = 0
+        self._images = 0
+        self._cube = {}
+
+    def _add_cube(self, cube):
+        for key, (n, secs) in cube.items():
+            cell = self._cube.get(key)
+            if cell is None:
+                cell = self._cube[key] = [0, 0]
+            cell[0] += n
+            cell[1] += secs
+
+    def add_run(self, ra):
+        self._runs += 1
+        self._images += ra.count()
+        self._add_cube(ra.cube())
+
+    def merge(self, other):
+        self._runs += other._runs
+        self._images += other._images
+        self._add_cube(other._cube)
+        return self
+
+    def runs(self):
+        return self._runs
+
+    def images(self):
+        return self._images
+
+    def count_of(self, type=None, side=None, correct=_ANY):
+        return _cube_aggregate(self._cube, type, side, correct)[0]
+
+    def time_of(self, type=None, side=None, correct=_ANY):
+        return _cube_aggregate(self._cube, type, side, correct)[1]
+
+    def accuracy_of(self, type=None, side=None):
+        items = self.count_of(type, side)
+        if items == 0:
+            return float('nan')
+        return self.count_of(type, side, correct=True) * 1.0 / items
+
+    def to_dict(self):
+        return {
+            'runs': self._runs,
+            'images': self._images,
+            'cube': _cube_to_list(self._cube),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        summary = cls()
+        summary._runs = d['runs']
+        summary._images = d['images']
+        summary._cube = _cube_from_list(d['cube'])
+        return summary
+
+def format_record(results):
+    "returns the log line (without newline) recording `results`"
+    guesses = [g if isinstance(g, guess.Guess) else guess.Guess.from_dict(g)
+               for g in results['guess_log']]
+    cube = _cube_of(guesses)
+    summary = dict((k, results[k]) for k in _SUMMARY_KEYS)
+    summary['version'] = RECORD_VERSION
+    summary['duration'] = _cube_aggregate(cube)[1]
+    summary['guesses'] = len(guesses)
+    summary['cube'] = _cube_to_list(cube)
+    return "%s%s%s" % (json.dumps(summary), RECORD_SEP,
+                       json.dumps({'guess_log': guesses}, default=guess.to_json))
+
 def save_results(path, results):
-    f = open(path, 'a')
-    json.dump(results, f)
-    f.write("\n")
-
-def each_run_analysis(path):
-    for line in open(path):
-        l = line.strip()
-        if len(l) == 0 or l[0] == '#':
+    with open(path, 'a') as f:
+        f.write(format_record(results))
+        f.write("\n")
+
+def each_run_line(path, since=None, until=None):
+    """yields the raw JSON text of each run recorded in `path`, which is
+    either a results log or a directory of segments; segments of months
+    outside [since, until) are skipped without being opened, and the rest
+    whose headers show no runs in the range without being read"""
+    if os.path.isdir(path):
+        for seg in segments.segment_paths(path, since, until):
+            if segments.overlaps(segments.read_header(seg), since, until):
+                for l in segments.each_line(seg):
+                    yield l
+        return
+    with open(path) as fobj:
+        for line in fobj:
+            l = line.strip()
+            if len(l) == 0 or l[0] == '#':
+                continue
+            yield l
+
+def _in_range(runs, since=None, until=None):
+    for ra in runs:
+        if since is not None and ra.start() < since:
+            continue
+        if until is not None and ra.start() >= until:
             continue
-        yield RunAnalysis(l)
-
-def analyze(path):
-    for ra in each_run_analysis(path):
-        start = ts2dt(ra.start())
-        duration = sum(ra.values_of('guess_time'))
-        n = ra.count()
-        h = ra.count_of(type='hands')
-        f = ra.count_of(type='feet')
-        l = ra.count_of(side='left')
-        r = ra.count_of(side='right')
-        c = ra.correct()
-        c_h = ra.count_of(type='hands', correct=True)
-        c_f = ra.count_of(type='feet', correct=True)
-        c_l = ra.count_of(side='left', correct=True)
-        c_r = ra.count_of(side='right', correct=True)
-        a_h = ra.accuracy_of(type='hands') * 100
-        a_f = ra.accuracy_of(type='feet') * 100
-        a_l = ra.accuracy_of(side='left') * 100
-        a_r = ra.accuracy_of(side='right') * 100
-        print("Run %s - %.03f seconds for %d images" % (
-            start.strftime(TIME_FMT), duration, n))
-        print("Pain level: %d" % (ra.pain_level(),))
-        print("Total accuracy: %d/%d %.02f%%" % (c, n, ra.accuracy() * 100))
-        print("Hand accuracy: %d/%d %.02f%%" % (c_h, h, a_h))
-        print("Foot accuracy: %d/%d %.02f%%" % (c_f, f, a_f))
-        print("Left accuracy: %d/%d %.02f%%" % (c_l, l, a_l))
-        print("Right accuracy: %d/%d %.02f%%" % (c_r, r, a_r))
-        print("Average time per image: %.02f seconds" % (duration/n,))
-
-def write_csv(path, dest, append=False):
-    fobj = open(dest, 'a' if append else 'w')
-    def ts(type_side, **kwargs):
-        """Helper function to make ra_to_row simpler:
-            type_side:
-                'H' -> 'hands', 'F' -> 'feet'
-                'L' -> 'left', 'R' -> 'right'
-                'C' -> correct=True"""
-        tch = 'h' if 'h' in type_side.lower() else 'f'
-        sch = 'l' if 'l' in type_side.lower() else 'r'
-        if 'c' in type_side.lower():
-            kwargs['correct'] = True
-        kwargs['type'] = {'h': 'hands', 'f': 'feet'}[tch]
-        kwargs['side'] = {'l': 'left', 'r': 'right'}[sch]
-        return kwargs
-
-    def ra_to_row(ra):
-        """
-        Notation:
-            H -> Hands, F -> Feet, L -> Left, R -> Right, C -> Correct
-
-        [timestamp as "Day Mon Year Hour:Min:Sec",
-         pain_level as int 0 - 10,
-         'hands' or 'feet' or 'hands feet',
-         test_length as seconds,
-         test_count as int,
-         correct as int,
-         count_HL as int,
-         count_HR as int,
-         count_FL as int,
-         count_FR as int,
-         count_HLC as int,
-         count_HRC as int,
-         count_FLC as int,
-         count_FRC as int,
-         total_time_HL as seconds,
-         total_time_HR as seconds,
-         total_time_FL as seconds,
-         total_time_FR as seconds,
-         total_time_HLC as seconds,
-         total_time_HRC as seconds,
-         total_time_FLC as seconds,
-         total_time_FRC as seconds]
-        """
-        row = [ts2dt(ra.start()).strftime(TIME_FMT),
-                ra.pain_level(),
-                ra.kinds(),
-                sum(ra.values_of('guess_time')),
-                ra.count(), ra.correct()]
-        for correct in ('', 'c'):
-            for type in 'HF':
-                for side in 'LR':
-                    args = ts("%s%s%s" % (type, side, correct))
-                    row.append(ra.count_of(**args))
-        for correct in ('', 'c'):
-            for type in 'HF':
-                for side in 'LR':
-                    args = ts("%s%s%s" % (type, side, correct))
-                    row.append(sum(ra.values_of('guess_time', **args)))
-        return row
-
-    w = csv.writer(fobj)
+        yield ra
+
+def _map_bounded(func, args, pool=None, inflight=1):
+    """yields func(arg) for each of `args`, in order; with a pool, at most
+    `inflight` calls are submitted but not yet yielded at any time"""
+    if pool is None:
+        for arg in args:
+            yield func(arg)
+        return
+    args = iter(args)
+    pending = collections.deque(pool.apply_async(func, (arg,))
+                                for arg in itertools.islice(args, inflight))
+    while pending:
+        result = pending.popleft().get()
+        for arg in itertools.islice(args, 1):
+            pending.append(pool.apply_async(func, (arg,)))
+        yield result
+
+def _parse_chunk(lines):
+    "worker: parses a chunk of run lines"
+    return [RunAnalysis(l) for l in lines]
+
+class _Parser(object):
+    """Parses run lines into RunAnalysis objects, sharing a pool of `jobs`
+    processes between all the streams being merged when jobs > 1, or the
+    given `pool`, which is left open"""
+    def __init__(self, jobs=1, pool=None):
+        self._owned = pool is None and jobs > 1
+        self._pool = multiprocessing.Pool(jobs) if self._owned else pool
+        self._jobs = jobs
+
+    def runs(self, lines):
+        """yields a RunAnalysis of each line; with a pool, lines are parsed
+        MERGE_CHUNK at a time with at most MERGE_PREFETCH chunks per job in
+        flight"""
+        lines = iter(lines)
+        chunks = iter(lambda: list(itertools.islice(lines, MERGE_CHUNK)), [])
+        for chunk in _map_bounded(_parse_chunk, chunks, self._pool,
+                                  MERGE_PREFETCH * self._jobs):
+            for ra in chunk:
+                yield ra
+
+    def close(self):
+        if self._owned:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+
+def _in_order(runs, name, window=MERGE_WINDOW):
+    """yields `runs` in start_time order, reordering through a heap of
+    `window` runs; raises ValueError naming `name` if a run is further out of
+    place than that"""
+    heap = []
+    last = None
+    for seq, ra in enumerate(runs):
+        heapq.heappush(heap, (ra.start(), seq, ra))
+        if len(heap) <= window:
+            continue
+        start, _, ra = heapq.heappop(heap)
+        if last is not None and start < last:
+            raise ValueError("%s: runs are out of start time order by more "
+                             "than %d runs; sort it first" % (name, window))
+        last = start
+        yield ra
+    while heap:
+        start, _, ra = heapq.heappop(heap)
+        if last is not None and start < last:
+            raise ValueError("%s: runs are out of start time order by more "
+                             "than %d runs; sort it first" % (name, window))
+        last = start
+        yield ra
+
+def _skip_duplicate(ra):
+    sys.stderr.write("Skipping duplicate run started %s\n" % (
+        ts2dt(ra.start()).strftime(TIME_FMT),))
+
+def _dedup(runs):
+    """drops runs, arriving in start_time order, whose start_time and
+    fingerprint match a run already yielded; fingerprints (which decode the
+    detail of a record) are only taken of runs sharing a start_time"""
+    group = []
+    for ra in runs:
+        if group and ra.start() != group[0].start():
+            group = []
+        if group and any(ra.fingerprint() == g.fingerprint() for g in group):
+            _skip_duplicate(ra)
+            continue
+        group.append(ra)
+        yield ra
+
+def _dedup_unordered(runs):
+    """drops runs, in any order, repeating the summary_key of a run already
+    yielded; keeps one key per run in memory"""
+    seen = set()
+    for ra in runs:
+        key = ra.summary_key()
+        if key in seen:
+            _skip_duplicate(ra)
+            continue
+        seen.add(key)
+        yield ra
+
+def _group_runs(group, parser):
+    "yields the runs of a group of overlapping segments in start_time order"
+    return heapq.merge(*[_in_order(parser.runs(segments.each_line(seg)), seg)
+                         for seg, header in group], key=RunAnalysis.start)
+
+def _file_runs(path, parser, since=None, until=None, ordered=True):
+    """yields the runs of a log, or of a segment directory, started in
+    [since, until); a segment directory is always read in start_time order
+    and a log only if `ordered` is True"""
+    if os.path.isdir(path):
+        runs = (ra for group in segments.overlapping_groups(path, since, until)
+                for ra in _group_runs(group, parser))
+    elif ordered:
+        runs = _in_order(parser.runs(each_run_line(path)), path)
+    else:
+        runs = parser.runs(each_run_line(path))
+    return _in_range(runs, since, until)
+
+def expand_inputs(patterns):
+    "expands each glob in `patterns`; patterns matching nothing are kept"
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        paths.extend(matches if matches else [pattern])
+    return paths
+
+def each_merged_run(paths, since=None, until=None, jobs=1, pool=None):
+    """yields the runs of every input in `paths`, logs or segment
+    directories, in start_time order. Runs with the start_time and
+    fingerprint of a run already yielded are dropped. Each input may be out
+    of order by up to MERGE_WINDOW runs (ValueError beyond that), and holds
+    at most that many runs plus MERGE_PREFETCH chunks per job in memory.
+    With jobs > 1 the lines are parsed in `pool`, if given, or else in a pool
+    of `jobs` processes.
+
+    A single log is instead read in its own order, dropping runs that repeat
+    the start_time and totals of an earlier run."""
+    parser = _Parser(jobs, pool)
+    try:
+        if len(paths) == 1 and not os.path.isdir(paths[0]):
+            runs = _dedup_unordered(_file_runs(paths[0], parser, since, until,
+                                               ordered=False))
+        else:
+            streams = [_file_runs(p, parser, since, until) for p in paths]
+            runs = _dedup(heapq.merge(*streams, key=RunAnalysis.start))
+        for ra in runs:
+            yield ra
+    finally:
+        parser.close()
+
+def each_run_analysis(path, since=None, until=None, jobs=1, pool=None):
+    """returns an iterator of a RunAnalysis for each distinct run started in
+    [since, until) in `path`, a log or segment directory or a list of them,
+    merged by each_merged_run"""
+    if not isinstance(path, (list, tuple)):
+        path = [path]
+    return each_merged_run(path, since, until, jobs, pool)
+
+def summarize(path, since=None, until=None, jobs=1):
+    """returns the Summary of runs in `path` started in [since, until), using
+    the precomputed aggregates of segments lying wholly inside the range
+    that no other segment overlaps"""
+    if isinstance(path, (list, tuple)) and len(path) == 1:
+        path = path[0]
+    summary = Summary()
+    if isinstance(path, (list, tuple)) or not os.path.isdir(path):
+        for ra in each_run_analysis(path, since, until, jobs):
+            summary.add_run(ra)
+        return summary
+    parser = _Parser(jobs)
+    try:
+        for group in segments.overlapping_groups(path, since, until):
+            header = group[0][1]
+            if len(group) == 1 and segments.within(header, since, until):
+                summary.merge(Summary.from_dict(header['summary']))
+                continue
+            for ra in _dedup(_in_range(_group_runs(group, parser), since, until)):
+                summary.add_run(ra)
+    finally:
+        parser.close()
+    return summary
+
+def _sort_body(body, index):
+    """rewrites the run lines of the file `body` in start_time order, given
+    `index`, a (start_time, offset) for every line"""
+    tmp = body + '.sorted'
+    with open(body, 'rb') as src:
+        with open(tmp, 'wb') as out:
+            for start, offset in sorted(index):
+                src.seek(offset)
+                out.write(src.readline())
+    os.rename(tmp, body)
+
+def compact(path, dest):
+    """moves every run in the log `path` into new segment files in the
+    directory `dest`, one per month, and returns the segments written; runs
+    are written in start_time order and duplicated runs once"""
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    work = path + '.compacting'
+    if os.path.exists(work):
+        raise RuntimeError("%s exists; an earlier compaction did not finish"
+                           % (work,))
+    os.rename(path, work)
+    months = {}
+    written = []
+    seen = set()
+    try:
+        for l in each_run_line(work):
+            ra = RunAnalysis(l)
+            if (ra.start(), ra.fingerprint()) in seen:
+                continue
+            seen.add((ra.start(), ra.fingerprint()))
+            month = segments.month_of(ra.start())
+            if month not in months:
+                body = os.path.join(dest, "%s.body.tmp" % (month,))
+                months[month] = {'fobj': open(body, 'wb'), 'body': body,
+                                 'index': [], 'summary': Summary(),
+                                 'start': ra.start(), 'end': ra.start()}
+            m = months[month]
+            m['index'].append((ra.start(), m['fobj'].tell()))
+            m['fobj'].write(l.encode('utf-8'))
+            m['fobj'].write(b"\n")
+            m['summary'].add_run(ra)
+            m['start'] = min(m['start'], ra.start())
+            m['end'] = max(m['end'], ra.start())
+        for month in sorted(months):
+            m = months[month]
+            m['fobj'].close()
+            _sort_body(m['body'], m['index'])
+            header = {'start': m['start'], 'end': m['end'],
+                      'runs': m['summary'].runs(),
+                      'summary': m['summary'].to_dict()}
+            written.append(segments.write_segment(dest, month, header,
+                                                  m['body']))
+    except BaseException:
+        for m in months.values():
+            m['fobj'].close()
+        # put the log back unless runs already went into segments or the
+        # program has since started a new one
+        if not written and not os.path.exists(path):
+            os.rename(work, path)
+        raise
+    finally:
+        for m in months.values():
+            for tmp in (m['body'], m['body'] + '.sorted'):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+    os.remove(work)
+    return written
+
+def print_run(ra):
+    "prints the console summary of a single run"
+    start = ts2dt(ra.start())
+    duration = ra.duration()
+    n = ra.count()
+    h = ra.count_of(type='hands')
+    f = ra.count_of(type='feet')
+    l = ra.count_of(side='left')
+    r = ra.count_of(side='right')
+    c = ra.correct()
+    c_h = ra.count_of(type='hands', correct=True)
+    c_f = ra.count_of(type='feet', correct=True)
+    c_l = ra.count_of(side='left', correct=True)
+    c_r = ra.count_of(side='right', correct=True)
+    a_h = ra.accuracy_of(type='hands') * 100
+    a_f = ra.accuracy_of(type='feet') * 100
+    a_l = ra.accuracy_of(side='left') * 100
+    a_r = ra.accuracy_of(side='right') * 100
+    print("Run %s - %.03f seconds for %d images" % (
+        start.strftime(TIME_FMT), duration, n))
+    print("Pain level: %d" % (ra.pain_level(),))
+    print("Total accuracy: %d/%d %.02f%%" % (c, n, ra.accuracy() * 100))
+    print("Hand accuracy: %d/%d %.02f%%" % (c_h, h, a_h))
+    print("Foot accuracy: %d/%d %.02f%%" % (c_f, f, a_f))
+    print("Left accuracy: %d/%d %.02f%%" % (c_l, l, a_l))
+    print("Right accuracy: %d/%d %.02f%%" % (c_r, r, a_r))
+    print("Average time per image: %.02f seconds" % (duration/n,))
+
+def analyze(path, since=None, until=None, jobs=1):
+    for ra in each_run_analysis(path, since, until, jobs):
+        print_run(ra)
+
+def print_summary(summary):
+    "prints the console summary of many runs"
+    n = summary.count_of()
+    c = summary.count_of(correct=True)
+    print("%d runs - %.03f seconds for %d images" % (
+        summary.runs(), summary.time_of(), n))
+    if n == 0:
+        return
+    print("Total accuracy: %d/%d %.02f%%" % (c, n, c * 100.0 / n))
+    for label, kw in (("Hand", {'type': 'hands'}), ("Foot", {'type': 'feet'}),
+                      ("Left", {'side': 'left'}), ("Right", {'side': 'right'})):
+        print("%s accuracy: %d/%d %.02f%%" % (
+            label, summary.count_of(correct=True, **kw), summary.count_of(**kw),
+            summary.accuracy_of(**kw) * 100))
+    print("Average time per image: %.02f seconds" % (summary.time_of() / n,))
+
+class LogTail(object):
+    """Reads the complete records appended to a growing results log. A
+    trailing line without its newline is held back until it is finished,
+    and the log is reopened if it is truncated or replaced."""
+    def __init__(self, path):
+        self._path = path
+        self._fobj = None
+        self._ino = None
+        self._partial = ''
+
+    def _reopen(self):
+        self.close()
+        try:
+            self._fobj = open(self._path)
+        except (IOError, OSError):
+            return False
+        self._ino = os.fstat(self._fobj.fileno()).st_ino
+        self._partial = ''
+        return True
+
+    def close(self):
+        if self._fobj is not None:
+            self._fobj.close()
+            self._fobj = None
+
+    def read_lines(self):
+        "returns the run lines completed since the last call"
+        if self._fobj is None and not self._reopen():
+            return []
+        try:
+            st = os.stat(self._path)
+        except OSError:
+            st = None
+        if st is not None and (st.st_ino != self._ino or
+                               st.st_size < self._fobj.tell()):
+            if not self._reopen():
+                return []
+        data = self._fobj.read()
+        if not data:
+            return []
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        return [l.strip() for l in lines
+                if l.strip() and l.strip()[0] != '#']
+
+def _change_waiter(path, interval):
+    """returns a function blocking until `path` may have changed: through
+    inotify when inotify_simple is available, otherwise by sleeping
+    `interval` seconds between polls"""
+    if inotify_simple is not None:
+        flags = inotify_simple.flags
+        ino = inotify_simple.INotify()
+        ino.add_watch(os.path.dirname(os.path.abspath(path)),
+                      flags.MODIFY | flags.CLOSE_WRITE | flags.CREATE |
+                      flags.MOVED_TO | flags.DELETE)
+        def wait():
+            # the timeout covers events missed while the directory is swapped
+            ino.read(timeout=int(interval * 1000 * 10))
+        return wait
+    return lambda: time.sleep(interval)
+
+def follow(path, csv_dest=None, append=False, interval=FOLLOW_INTERVAL):
+    """Print runs as they are appended to `path`, also appending them to the
+    summary CSV `csv_dest` if given, until interrupted"""
+    tail = LogTail(path)
+    wait = _change_waiter(path, interval)
+    fobj = w = None
+    if csv_dest is not None:
+        fobj = open(csv_dest, 'a' if append else 'w')
+        w = csv.writer(fobj)
+        if not append:
+            w.writerow(csv_headers())
+    try:
+        while True:
+            lines = tail.read_lines()
+            if not lines:
+                wait()
+                continue
+            for line in lines:
+                try:
+                    ra = RunAnalysis(line)
+                except ValueError as e:
+                    sys.stderr.write("Skipping malformed record: %s\n" % (e,))
+                    continue
+                print_run(ra)
+                if w is not None:
+                    w.writerow(ra_to_row(ra))
+            sys.stdout.flush()
+            if fobj is not None:
+                fobj.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tail.close()
+        if fobj is not None:
+            fobj.close()
+
+def dist_key(kind=None, side=None):
+    "key of the distribution for `kind` and `side` (None meaning all)"
+    return "%s/%s" % (kind or 'all', side or 'all')
+
+def distributions(path, dists=None, since=None, until=None, jobs=1):
+    """returns {dist_key(kind, side): TimeDistribution} of the guess_time of
+    every answered guess in `path`, merged into `dists` if given"""
+    if dists is None:
+        dists = {}
+    for ra in each_run_analysis(path, since, until, jobs):
+        for item in ra.items():
+            if item.guess_time is None:
+                continue
+            for kind in (None, item.type):
+                for side in (None, item.side):
+                    key = dist_key(kind, side)
+                    if key not in dists:
+                        dists[key] = sketch.TimeDistribution()
+                    dists[key].add(item.guess_time)
+    return dists
+
+def write_distributions(dists, dest):
+    with open(dest, 'w') as fobj:
+        json.dump(dict((k, d.to_dict()) for k, d in dists.items()), fobj)
+        fobj.write("\n")
+
+def read_distributions(src, dists=None):
+    "loads distributions saved by write_distributions, merging into `dists`"
+    if dists is None:
+        dists = {}
+    with open(src) as fobj:
+        for key, d in json.load(fobj).items():
+            dist = sketch.TimeDistribution.from_dict(d)
+            if key in dists:
+                dists[key].merge(dist)
+            else:
+                dists[key] = dist
+    return dists
+
+def analyze_distributions(dists, histograms=False):
+    for key in sorted(dists):
+        sk = dists[key].sketch
+        qs = ' '.join("p%d=%.03fs" % (q * 100, sk.quantile(q))
+                      for q in DIST_QUANTILES)
+        print("Reaction time %s: n=%d mean=%.03fs %s (+/- %g%%)" % (
+            key, sk.count(), sk.mean(), qs, sk.accuracy() * 100))
+        if histograms:
+            for line in dists[key].histogram.format():
+                print("    %s" % (line,))
+
+def _ts(type_side, **kwargs):
+    """Helper function to make ra_to_row simpler:
+        type_side:
+            'H' -> 'hands', 'F' -> 'feet'
+            'L' -> 'left', 'R' -> 'right'
+            'C' -> correct=True"""
+    tch = 'h' if 'h' in type_side.lower() else 'f'
+    sch = 'l' if 'l' in type_side.lower() else 'r'
+    if 'c' in type_side.lower():
+        kwargs['correct'] = True
+    kwargs['type'] = {'h': 'hands', 'f': 'feet'}[tch]
+    kwargs['side'] = {'l': 'left', 'r': 'right'}[sch]
+    return kwargs
+
+def ra_to_row(ra):
+    """
+    Notation:
+        H -> Hands, F -> Feet, L -> Left, R -> Right, C -> Correct
+
+    [timestamp as "Day Mon Year Hour:Min:Sec",
+     pain_level as int 0 - 10,
+     'hands' or 'feet' or 'hands feet',
+     test_length as seconds,
+     test_count as int,
+     correct as int,
+     count_HL as int,
+     count_HR as int,
+     count_FL as int,
+     count_FR as int,
+     count_HLC as int,
+     count_HRC as int,
+     count_FLC as int,
+     count_FRC as int,
+     total_time_HL as seconds,
+     total_time_HR as seconds,
+     total_time_FL as seconds,
+     total_time_FR as seconds,
+     total_time_HLC as seconds,
+     total_time_HRC as seconds,
+     total_time_FLC as seconds,
+     total_time_FRC as seconds]
+    """
+    row = [ts2dt(ra.start()).strftime(TIME_FMT),
+            ra.pain_level(),
+            ra.kinds(),
+            ra.duration(),
+            ra.count(), ra.correct()]
+    for correct in ('', 'c'):
+        for type in 'HF':
+            for side in 'LR':
+                args = _ts("%s%s%s" % (type, side, correct))
+                row.append(ra.count_of(**args))
+    for correct in ('', 'c'):
+        for type in 'HF':
+            for side in 'LR':
+                args = _ts("%s%s%s" % (type, side, correct))
+                row.append(ra.time_of(**args))
+    return row
+
+def csv_headers():
     headers = ['timestamp', 'pain_level', 'kinds', 'duration', 'count',
                 'correct']
     for what in 'count correct time correct_time'.split():
         for type in 'hands feet'.split():
             for side in 'left right'.split():
                 headers.append("%s_%s_%s" % (what, type, side))
+    return headers
 
-    if not append:
-        w.writerow(headers)
+def write_csv(path, dest, append=False, since=None, until=None, jobs=1):
+    with open(dest, 'a' if append else 'w') as fobj:
+        w = csv.writer(fobj)
+        if not append:
+            w.writerow(csv_headers())
+        for ra in each_run_analysis(path, since, until, jobs):
+            w.writerow(ra_to_row(ra))
 
-    for ra in each_run_analysis(path):
-        w.writerow(ra_to_row(ra))
+def detailed_rows(ra, run=None):
+    """yields one detailed CSV row per guess in `ra`, prefixed by `run` if it
+    is given; the run timestamp is formatted only once"""
+    prefix = [ts2dt(ra.start()).strftime(TIME_FMT)]
+    if run is not None:
+        prefix.insert(0, run)
+    for item in ra.items():
+        yield prefix + list(_guess_fields(item))
 
-def write_detailed_csv(path, dest):
-    headers = ['timestamp', 'image_id', 'image', 'type', 'side', 'time',
-               'correct', 'guess', 'guess_time']
-    dirname, filename = os.path.split(dest)
-    for i,ra in enumerate(each_run_analysis(path)):
-        fobj = open(os.path.join(dirname, "%d_%s" % (i+1, filename)), 'w')
+def _export_run_file(job):
+    "worker: writes a single run to its own detailed CSV file"
+    dest, ra = job
+    with open(dest, 'w', EXPORT_BUFSIZE) as fobj:
         w = csv.writer(fobj)
-        w.writerow(headers)
-        for item in ra.items():
-            row = [ts2dt(ra.start()).strftime(TIME_FMT),
-                    item['image_id'], item['image'], item['type'],
-                    item['side'], item['time'], item['correct'],
-                    item['guess'], item['guess_time']]
-            w.writerow(row)
+        w.writerow(DETAILED_HEADERS)
+        w.writerows(detailed_rows(ra))
+    return dest
+
+def _format_run(job):
+    "worker: formats a single run's rows for a partitioned CSV file"
+    run, ra = job
+    return list(detailed_rows(ra, run))
+
+def write_detailed_csv(path, dest, mode='split', workers=1, since=None,
+                       until=None):
+    """write_detailed_csv(path, dest, mode='split', workers=1, since=None,
+                          until=None)
+
+    Export every guess of every distinct run started in [since, until) in
+    `path`, a log or segment directory or a list of them, in the order
+    each_run_analysis yields them.
+
+    mode:
+        'split'     one file per run, N_<dest> for N = 1, 2, 3, ...; each
+                    worker holds at most one file open at a time
+        'single'    one file <dest> partitioned by a leading 'run' column
+        'gzip'      as 'single', but gzip-compressed
+    workers:    number of processes to read, format (and for 'split', write)
+                runs, with at most EXPORT_PREFETCH runs per worker in flight
+    """
+    if mode not in DETAILED_MODES:
+        raise ValueError("mode must be one of %s" % (', '.join(DETAILED_MODES),))
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        runs = enumerate(each_run_analysis(path, since, until, workers, pool))
+        inflight = EXPORT_PREFETCH * workers
+        if mode == 'split':
+            dirname, filename = os.path.split(dest)
+            jobs = ((os.path.join(dirname, "%d_%s" % (i+1, filename)), ra)
+                    for i, ra in runs)
+            for _ in _map_bounded(_export_run_file, jobs, pool, inflight):
+                pass
+            return
+        if mode == 'gzip':
+            fobj = gzip.open(dest, 'wt')
+        else:
+            fobj = open(dest, 'w', EXPORT_BUFSIZE)
+        with fobj:
+            w = csv.writer(fobj)
+            w.writerow(['run'] + DETAILED_HEADERS)
+            jobs = ((i+1, ra) for i, ra in runs)
+            for rows in _map_bounded(_format_run, jobs, pool, inflight):
+                w.writerows(rows)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def report(p, args, paths, since, until):
+    "writes the outputs requested on the command line"
+    if args.summary:
+        print_summary(summarize(paths, since, until, args.jobs))
+    else:
+        analyze(paths, since, until, args.jobs)
+    if args.dist or args.dist_out:
+        dists = {}
+        for src in args.dist_merge:
+            read_distributions(src, dists)
+        distributions(paths, dists, since, until, args.jobs)
+        if args.dist:
+            analyze_distributions(dists, histograms=args.hist)
+        if args.dist_out:
+            write_distributions(dists, args.dist_out)
+    if args.csv:
+        write_csv(paths, args.csv, append=args.append, since=since,
+                  until=until, jobs=args.jobs)
+    if args.detailed_csv:
+        write_detailed_csv(paths, args.detailed_csv,
+                           mode=args.detailed_mode, workers=args.jobs,
+                           since=since, until=until)
 
 if __name__ == "__main__":
-    p = argparse.ArgumentParser(usage="%(prog)s [options] <file>")
-    p.add_argument("file", type=str, help="file to analyze")
+    p = argparse.ArgumentParser(usage="%(prog)s [options] <file> [<file>...]")
+    p.add_argument("file", type=str, nargs="+",
+                   help="files or globs to analyze, or directories of "
+                        "segments; runs from several are merged by start time "
+                        "and duplicates dropped")
     p.add_argument("--csv", type=str, metavar="FILE",
                    help="write summary CSV to <FILE>")
     p.add_argument("-a", "--append", action="store_true",
                    help="append to CSV file; do not overwrite")
     p.add_argument("--detailed-csv", type=str, metavar="FILE",
                    help="write each test to N_<FILE>, N = 1, 2, 3, ...")
+    p.add_argument("--detailed-mode", choices=DETAILED_MODES, default='split',
+                   help="'split' into N_<FILE> (default), a 'single' <FILE> "
+                        "with a run column, or a 'gzip' compressed <FILE>")
+    p.add_argument("-j", "--jobs", type=int, metavar="NUM", default=1,
+                   help="read several files, and export detailed CSV, using "
+                        "NUM processes (default 1)")
+    p.add_argument("--dist", action="store_true",
+                   help="report reaction time quantiles per kind and side")
+    p.add_argument("--hist", action="store_true",
+                   help="with --dist, also print reaction time histograms")
+    p.add_argument("--dist-out", type=str, metavar="FILE",
+                   help="save reaction time sketches to <FILE>")
+    p.add_argument("--dist-merge", type=str, metavar="FILE", action="append",
+                   default=[], help="merge sketches saved in <FILE> (repeatable)")
+    p.add_argument("-f", "--follow", action="store_true",
+                   help="keep running, reporting runs as they are appended")
+    p.add_argument("--interval", type=float, metavar="SECS",
+                   default=FOLLOW_INTERVAL,
+                   help="with --follow, poll every SECS seconds when inotify "
+                        "is unavailable (default %.1f)" % (FOLLOW_INTERVAL,))
+    p.add_argument("--compact", type=str, metavar="DIR",
+                   help="move the runs in <file> into monthly segments in "
+                        "<DIR> and exit")
+    p.add_argument("--since", type=str, metavar="YYYY-MM-DD",
+                   help="only consider runs started on or after this date")
+    p.add_argument("--until", type=str, metavar="YYYY-MM-DD",
+                   help="only consider runs started on or before this date")
+    p.add_argument("-s", "--summary", action="store_true",
+                   help="print totals over all runs instead of each run")
     args = p.parse_args()
-    analyze(args.file)
-    if args.csv:
-        write_csv(args.file, args.csv, append=args.append)
-    if args.detailed_csv:
-        write_detailed_csv(args.file, args.detailed_csv)
-
-
+    paths = expand_inputs(args.file)
+    if len(paths) > 1:
+        for opt, given in (("--follow", args.follow),
+                           ("--compact", args.compact)):
+            if given:
+                p.error("%s takes a single file" % (opt,))
+    if args.follow and os.path.isdir(paths[0]):
+        p.error("--follow takes a log file, not a directory of segments")
+    if args.follow:
+        follow(paths[0], args.csv, append=args.append, interval=args.interval)
+        raise SystemExit(0)
+    if args.compact:
+        for seg in compact(paths[0], args.compact):
+            print("Wrote %s" % (seg,))
+        raise SystemExit(0)
+    since = date2ts(args.since) if args.since else None
+    until = date2ts(args.until) + 86400 if args.until else None
+    try:
+        report(p, args, paths, since, until)
+    except ValueError as e:
+        p.error(str(e))
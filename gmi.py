@@ -8,8 +8,10 @@ import random
 import sys
 import time
 
+_STARTUP_TIME = time.time()
+
+import guess
 import pyg
-import analysis
 
 import pygame
 import pygame.locals as pyl
@@ -38,6 +40,7 @@ ASSETS_LFOOT = os.path.join(ASSETS_FEET, "left")
 ASSETS_RFOOT = os.path.join(ASSETS_FEET, "right")
 ASSET_KINDS = ("hands", "feet")
 ASSET_SIDES = ("left", "right")
+MIRROR_SUFFIX = "#mirrored"
 
 ASSETS_ERROR_MESSAGE = """\
 %(error)sERROR!!!%(end)s%(bold)s
@@ -54,10 +57,15 @@ Example:
     %(rf)s%(end)s
 
 Exiting \
-""" % dict(assets=ASSETS_PATH, env=ASSETS_ENV, self=SELF,
-           default=ASSETS_PATH_DEFAULT, args=' '.join(sys.argv[1:]),
-           lh=ASSETS_LHAND, rh=ASSETS_RHAND, lf=ASSETS_LFOOT, rf=ASSETS_RFOOT,
-           error=_ERROR, end=_END, bold=_BOLD)
+"""
+
+def assets_error_message():
+    "formats ASSETS_ERROR_MESSAGE; only needed when no assets are found"
+    return ASSETS_ERROR_MESSAGE % dict(
+        assets=ASSETS_PATH, env=ASSETS_ENV, self=SELF,
+        default=ASSETS_PATH_DEFAULT, args=' '.join(sys.argv[1:]),
+        lh=ASSETS_LHAND, rh=ASSETS_RHAND, lf=ASSETS_LFOOT, rf=ASSETS_RFOOT,
+        error=_ERROR, end=_END, bold=_BOLD)
 
 def make_asset_dirs():
     for k in ASSET_KINDS:
@@ -73,17 +81,50 @@ def image_kind(path):
         return "feet"
     return None
 
+def mirror_of(path):
+    "names the stimulus made by mirroring the image at `path`"
+    return path + MIRROR_SUFFIX
+
+def is_mirrored(path):
+    return path.endswith(MIRROR_SUFFIX)
+
+def source_of(path):
+    "returns the image file a stimulus is shown from"
+    if is_mirrored(path):
+        return path[:-len(MIRROR_SUFFIX)]
+    return path
+
 def image_side(path):
+    side = None
     if '/left/' in path:
-        return 'left'
-    if '/right/' in path:
-        return 'right'
-    return None
+        side = 'left'
+    elif '/right/' in path:
+        side = 'right'
+    if side is not None and is_mirrored(path):
+        side = {'left': 'right', 'right': 'left'}[side]
+    return side
 
 def list_files(path):
     for item in os.listdir(path):
         yield os.path.join(path, item)
 
+_asset_lists = None
+def scan_assets():
+    """returns {kind: {side: [paths]}} for every asset directory; the
+    directories are listed once and the result reused afterwards"""
+    global _asset_lists
+    if _asset_lists is None:
+        _asset_lists = {}
+        for k in ASSET_KINDS:
+            _asset_lists[k] = {}
+            for s in ASSET_SIDES:
+                d = os.path.join(ASSETS_PATH, k, s)
+                _asset_lists[k][s] = sorted(list_files(d))
+    return _asset_lists
+
+def count_assets():
+    return sum(len(seq) for lr in scan_assets().values() for seq in lr.values())
+
 def rand_resize_list(seq, size):
     if len(seq) < size:
         while len(seq) < size:
@@ -93,12 +134,22 @@ def rand_resize_list(seq, size):
             del seq[random.randrange(0, len(seq))]
     return seq
 
+_image_ids = {}
 def hash_image(path):
-    return hashlib.sha256(open(path).read()).hexdigest()[:8]
+    """returns the id of a stimulus: a hash of its image file, or for a
+    mirrored stimulus a hash of its source's id; each file is read once"""
+    if path not in _image_ids:
+        if is_mirrored(path):
+            data = (MIRROR_SUFFIX + hash_image(source_of(path))).encode('ascii')
+        else:
+            with open(path, "rb") as fobj:
+                data = fobj.read()
+        _image_ids[path] = hashlib.sha256(data).hexdigest()[:8]
+    return _image_ids[path]
 
 class GMITest(object):
     def __init__(self, pain_level, limit_to=None, equal_assets=True,
-                 num_images=30, verbose=False):
+                 num_images=30, verbose=False, mirror=False):
         # verify arguments
         if not 0 <= pain_level <= 10:
             raise ValueError("Pain level must be in [0, 10]")
@@ -123,16 +174,18 @@ class GMITest(object):
         self._guess_log = []
 
         # initialize and prepare asset lists
-        if 'hands' in self._test_items:
-            self._assets['hands'] = {
-                'left': list(list_files(ASSETS_LHAND)),
-                'right': list(list_files(ASSETS_RHAND))
-            }
-        if 'feet' in self._test_items:
-            self._assets['feet'] = {
-                'left': list(list_files(ASSETS_LFOOT)),
-                'right': list(list_files(ASSETS_RFOOT)),
+        assets = scan_assets()
+        for kind in self._test_items:
+            self._assets[kind] = {
+                'left': list(assets[kind]['left']),
+                'right': list(assets[kind]['right']),
             }
+            # each image also stands in, mirrored, for the opposite side
+            if mirror:
+                lr = self._assets[kind]
+                lr['left'], lr['right'] = (
+                    lr['left'] + [mirror_of(p) for p in lr['right']],
+                    lr['right'] + [mirror_of(p) for p in lr['left']])
 
         # limit assets if desired
         if equal_assets:
@@ -150,7 +203,7 @@ class GMITest(object):
                 self._working_assets.extend(seq)
 
         if len(self._working_assets) == 0:
-            print(ASSETS_ERROR_MESSAGE)
+            print(assets_error_message())
             raise RuntimeError("No assets found. Please add assets to use")
         rand_resize_list(self._working_assets, self._num_images)
 
@@ -199,27 +252,25 @@ class GMITest(object):
         self._seen.append(item)
         self._curr = item
         self._curr_time = time.time()
-        self._guess_log.append({
-            'image': self._curr,
-            'image_id': hash_image(self._curr),
-            'type': image_kind(self._curr),
-            'side': image_side(self._curr),
-            'time': self._curr_time,
-            'correct': None,
-            'guess': None,
-            'guess_time': None,
-        })
+        self._guess_log.append(guess.Guess(
+            self._curr, hash_image(self._curr), image_kind(self._curr),
+            image_side(self._curr), self._curr_time))
         if self._start_time is None:
             self._start_time = time.time()
         return item
 
     def do_guess(self, side):
         correct = image_side(self._curr) == side
-        self._guess_log[-1]['guess'] = side
-        self._guess_log[-1]['correct'] = correct
-        self._guess_log[-1]['guess_time'] = time.time() - self._guess_log[-1]['time']
+        entry = self._guess_log[-1]
+        entry.guess = side
+        entry.correct = correct
+        entry.guess_time = time.time() - entry.time
         self.next()
     
+    def stimuli(self):
+        "the images shown so far, in order"
+        return [item.image for item in self._guess_log]
+
     def results(self):
         return {
             'pain_level': self._pain_level,
@@ -229,37 +280,25 @@ class GMITest(object):
             'guess_log': self._guess_log
         }
 
-def main():
-    p = argparse.ArgumentParser(usage="%(prog)s [options]", epilog="""
-
-environment variables:
-  GMI_NOCOLOR           if set, console errors will have no extra formatting
-  GMI_ASSETS_PATH       path to assets folder (default: ./assets)
-""", formatter_class=argparse.RawDescriptionHelpFormatter)
-    p.add_argument("--size", type=str, metavar="W,H", default="800,600",
-                   help="screen size of the form W,H (default: 800,600)")
-    p.add_argument("--limit", choices=('hands', 'feet'), default=None,
-                   help="limit to either 'hands' or 'feet' (default None)")
-    p.add_argument("-o", "--out", type=str, metavar="PATH", default="log.txt",
-                   help="file to record outputs to")
-    p.add_argument("-c", "--count", type=int, metavar="NUM", default=30,
-                   help="limit number of images to NUM (default 30)")
-    p.add_argument("-v", "--verbose", action="store_true",
-                   help="be verbose about operations performed")
-
-    args = p.parse_args()
-
-    num_files = 0
-    for k in ASSET_KINDS:
-        for s in ASSET_SIDES:
-            num_files += len(os.listdir(os.path.join(ASSETS_PATH, k, s)))
-    if num_files == 0:
-        print(ASSETS_ERROR_MESSAGE)
-        raise SystemExit(1)
-
-    w, h = args.size.split(',')
-    g = pyg.PyGame(mode=(int(w), int(h)), verbose=args.verbose)
-
+class StartupTimer(object):
+    "records the time spent in each startup phase"
+    def __init__(self, start=None):
+        self._last = start if start is not None else time.time()
+        self._start = self._last
+        self._phases = []
+
+    def mark(self, phase):
+        now = time.time()
+        self._phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self, fobj=sys.stderr):
+        for phase, secs in self._phases:
+            fobj.write("%-14s %8.03f ms\n" % (phase, secs * 1000))
+        fobj.write("%-14s %8.03f ms\n" % ("total", (self._last - self._start) * 1000))
+
+def run_session(g, args, timer):
+    "runs steps 1 through 3 of a test, returning the GMITest or None if quit"
     # 1) obtain pain level
     g.data_set(u'')
     def on_keydown_step1(gobj, event):
@@ -270,6 +309,10 @@ environment variables:
     g.bind_on_event(pyl.KEYDOWN, on_keydown_step1)
     pain_level = None
     g.text("What is your current pain level (0-10)?\nPress Enter when done")
+    g.render_end()
+    timer.mark("first prompt")
+    if args.timing:
+        timer.report()
     while pain_level is None and g.active():
         g.run_once(render=True)
         text = g.data_get()
@@ -282,7 +325,7 @@ environment variables:
     g.unbind_on_event(pyl.KEYDOWN, on_keydown_step1)
 
     if not g.active():
-        return
+        return None
 
     # 2) prompt user to start
     g.text("""Your pain level is %d
@@ -298,11 +341,15 @@ Press space to start.""" % (pain_level,))
     g.unbind_on_key(on_keydown_step2)
 
     if not g.active():
-        return
+        return None
 
     # 3) perform test
+    if args.lean and count_assets() == 0:
+        print(assets_error_message())
+        raise SystemExit(1)
     try:
-        g.data_set(GMITest(pain_level, limit_to='feet', verbose=args.verbose))
+        g.data_set(GMITest(pain_level, limit_to='feet', verbose=args.verbose,
+                           mirror=args.mirror))
     except ValueError as e:
         raise
     test = g.data_get()
@@ -314,17 +361,130 @@ Press space to start.""" % (pain_level,))
             gobj.data_get().do_guess("right")
     g.bind_on_event(pyl.KEYDOWN, on_keydown_step3)
     while not test.done() and g.active():
-        g.image(test.curr())
+        g.image(source_of(test.curr()), flip=is_mirrored(test.curr()))
         g.text("Image %d of %d" % (test.image_index(), test.image_count()),
                at=(0, 0), size=12)
         g.run_once(render=True)
+    return test
+
+def report_replay(replay, test, elapsed, fobj=sys.stderr):
+    "summarizes a replay and whether it showed the recorded images"
+    fobj.write("Replayed %d events in %.03f seconds\n" % (
+        replay.num_events(), elapsed))
+    expected = replay.stimuli()
+    if expected is None:
+        return
+    shown = test.stimuli() if test is not None else []
+    if shown == expected:
+        fobj.write("Stimuli match the recording (%d images)\n" % (len(shown),))
+    else:
+        fobj.write("Stimuli DIFFER from the recording: %d shown, %d recorded\n"
+                   % (len(shown), len(expected)))
+
+def main():
+    p = argparse.ArgumentParser(usage="%(prog)s [options]", epilog="""
+
+environment variables:
+  GMI_NOCOLOR           if set, console errors will have no extra formatting
+  GMI_ASSETS_PATH       path to assets folder (default: ./assets)
+""", formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--size", type=str, metavar="W,H", default="800,600",
+                   help="screen size of the form W,H (default: 800,600)")
+    p.add_argument("--limit", choices=('hands', 'feet'), default=None,
+                   help="limit to either 'hands' or 'feet' (default None)")
+    p.add_argument("-o", "--out", type=str, metavar="PATH", default=None,
+                   help="file to record outputs to (default log.txt, or "
+                        "nothing when replaying)")
+    p.add_argument("-c", "--count", type=int, metavar="NUM", default=30,
+                   help="limit number of images to NUM (default 30)")
+    p.add_argument("-v", "--verbose", action="store_true",
+                   help="be verbose about operations performed")
+    p.add_argument("--lean", action="store_true",
+                   help="fast startup: initialize only display and font and "
+                        "defer scanning assets until the test begins")
+    p.add_argument("--timing", action="store_true",
+                   help="print a startup timing breakdown to stderr")
+    p.add_argument("--seed", type=int, metavar="NUM", default=None,
+                   help="seed the random image order with NUM")
+    p.add_argument("--record", type=str, metavar="PATH", default=None,
+                   help="record input events, seed and images shown to PATH")
+    p.add_argument("--replay", type=str, metavar="PATH", default=None,
+                   help="replay a recording made with --record, headless and "
+                        "as fast as possible")
+    p.add_argument("--realtime", action="store_true",
+                   help="with --replay, replay events at their recorded times")
+    p.add_argument("-m", "--mirror", action="store_true",
+                   help="also show every image mirrored as the opposite side")
+
+    args = p.parse_args()
+    timer = StartupTimer(_STARTUP_TIME)
+    timer.mark("imports")
+
+    replay = None
+    if args.replay is not None:
+        import record
+        replay = record.EventReplay(args.replay, realtime=args.realtime)
+        opts = p.parse_args(replay.argv())
+        opts.replay, opts.realtime = args.replay, args.realtime
+        opts.out, opts.timing = args.out, args.timing
+        opts.verbose = opts.verbose or args.verbose
+        opts.record, opts.seed = None, replay.seed()
+        args = opts
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    elif args.out is None:
+        args.out = "log.txt"
+
+    seed = args.seed
+    if seed is None and args.record is not None:
+        seed = random.randrange(1 << 32)
+    if seed is not None:
+        random.seed(seed)
+
+    if not args.lean:
+        if count_assets() == 0:
+            print(assets_error_message())
+            raise SystemExit(1)
+        timer.mark("asset scan")
+
+    w, h = args.size.split(',')
+    g = pyg.PyGame(mode=(int(w), int(h)), verbose=args.verbose,
+                   lean=args.lean)
+    timer.mark("pygame init")
+
+    recorder = None
+    if args.record is not None:
+        import record
+        argv = list(sys.argv[1:])
+        idx = argv.index("--record") if "--record" in argv else None
+        if idx is not None:
+            del argv[idx:idx+2]
+        argv = [a for a in argv if not a.startswith("--record=")]
+        recorder = record.EventRecorder(args.record, seed, argv)
+        g.set_recorder(recorder)
+    if replay is not None:
+        g.set_event_source(replay.get_events)
+
+    replay_start = time.time()
+    try:
+        test = run_session(g, args, timer)
+        if recorder is not None and test is not None:
+            recorder.stimuli(test.stimuli())
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+    if replay is not None:
+        report_replay(replay, test, time.time() - replay_start)
+    if test is None:
+        return
     results = test.results()
     g.verbose("Results: %s", results)
 
     # 4) finally, save results
-    analysis.save_results(args.out, results)
+    if args.out is not None:
+        import analysis
+        analysis.save_results(args.out, results)
 
 if __name__ == "__main__":
     make_asset_dirs()
     main()
-
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""
+Compact guess records
+
+Guess stores one entry of a result's guess_log (see analysis.py) in slots
+instead of a dict. Kinds and sides are stored as small integer codes into
+KINDS and SIDES, and image paths and ids are interned so every guess of the
+same image shares one string. Guesses still support guess['key'] lookups
+and convert to and from the guess_log dict schema with to_dict/from_dict.
+"""
+
+import sys
+
+KINDS = ('hands', 'feet')
+SIDES = ('left', 'right')
+
+FIELDS = ('image', 'image_id', 'type', 'side', 'time', 'correct', 'guess',
+          'guess_time')
+
+_intern = sys.intern
+
+def _encode(names, value):
+    if value is None:
+        return -1
+    return names.index(value)
+
+def _decode(names, code):
+    if code < 0:
+        return None
+    return names[code]
+
+class Guess(object):
+    __slots__ = ('image', 'image_id', '_type', '_side', 'time', 'correct',
+                 '_guess', 'guess_time')
+
+    def __init__(self, image, image_id, type, side, time, correct=None,
+                 guess=None, guess_time=None):
+        self.image = _intern(image) if image is not None else None
+        self.image_id = _intern(image_id) if image_id is not None else None
+        self._type = _encode(KINDS, type)
+        self._side = _encode(SIDES, side)
+        self.time = time
+        self.correct = correct
+        self._guess = _encode(SIDES, guess)
+        self.guess_time = guess_time
+
+    @property
+    def type(self):
+        return _decode(KINDS, self._type)
+
+    @property
+    def side(self):
+        return _decode(SIDES, self._side)
+
+    @property
+    def guess(self):
+        return _decode(SIDES, self._guess)
+
+    @guess.setter
+    def guess(self, value):
+        self._guess = _encode(SIDES, value)
+
+    def __getitem__(self, key):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if not isinstance(other, Guess):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Guess(%s)" % (', '.join("%s=%r" % (k, getattr(self, k))
+                                        for k in FIELDS),)
+
+    def to_dict(self):
+        "returns the guess in the guess_log schema"
+        return dict((k, getattr(self, k)) for k in FIELDS)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['image'], d['image_id'], d['type'], d['side'], d['time'],
+                   d['correct'], d['guess'], d['guess_time'])
+
+def to_json(obj):
+    "json.dump default= hook serializing Guess records"
+    if isinstance(obj, Guess):
+        return obj.to_dict()
+    raise TypeError("%r is not JSON serializable" % (obj,))
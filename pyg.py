@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import collections
 import re
 import sys
 
@@ -53,9 +54,12 @@ def _dict_pop(d, k, *args):
 
 class PyGame(object):
     def __init__(self, mode=(800,600), text_color=C_WHITE, bg_color=C_BLACK,
-                 verbose=False, fps=30):
+                 verbose=False, fps=30, lean=False, image_cache_size=64):
         if not pygame.display.get_init():
-            pygame.init()
+            # lean startup skips pygame.init(), which also brings up audio,
+            # joystick and the other subsystems we never use
+            if not lean:
+                pygame.init()
             pygame.display.init()
             pygame.font.init()
 
@@ -71,6 +75,11 @@ class PyGame(object):
         self._bindings = {None: []}
         self._verbose = verbose
         self._data = None
+        self._event_source = pygame.event.get
+        self._images = collections.OrderedDict()
+        self._image_cache_size = image_cache_size
+        self._recorder = None
+        self._frame = 0
 
     def verbose(self, message, *args):
         if self._verbose:
@@ -169,12 +178,31 @@ class PyGame(object):
             surfaces = [font.render(t, aa, self._text_color, bg) for t in lines]
         self.draw_many(surfaces, at=at, **kwargs)
 
-    def image(self, path, at=None, **kwargs):
-        surf = pygame.image.load(path)
-        w, h = surf.get_width(), surf.get_height()
-        if w > self.width() or h > self.height():
-            surf = self._scale_surface(surf)
-        self.draw(surf, at=at, **kwargs)
+    def load_image(self, path, flip=False):
+        """load_image(path, flip=False)
+
+        Returns the image at `path`, scaled down to fit the screen and
+        mirrored left-to-right if `flip` is True. The most recently used
+        surfaces are cached; a mirrored surface is made from the cached
+        unmirrored one rather than decoding the file again.
+        """
+        key = (path, flip)
+        surf = self._images.pop(key, None)
+        if surf is None:
+            if flip:
+                surf = pygame.transform.flip(self.load_image(path), True, False)
+            else:
+                surf = pygame.image.load(path)
+                w, h = surf.get_width(), surf.get_height()
+                if w > self.width() or h > self.height():
+                    surf = self._scale_surface(surf)
+        self._images[key] = surf
+        while len(self._images) > self._image_cache_size:
+            self._images.popitem(last=False)
+        return surf
+
+    def image(self, path, at=None, flip=False, **kwargs):
+        self.draw(self.load_image(path, flip), at=at, **kwargs)
 
     def draw(self, surf, at=None, **kwargs):
         """draw(surf, at=None)
@@ -239,11 +267,22 @@ class PyGame(object):
         "True if `key` is pressed"
         return self.get_keystate()[key]
 
+    def set_event_source(self, func):
+        "use func() in place of pygame.event.get() to obtain events"
+        self._event_source = func
+
+    def set_recorder(self, recorder):
+        """call recorder.event(frame, event) for every event obtained, where
+        frame counts calls to run_once"""
+        self._recorder = recorder
+
     def get_events(self):
         "yields all un-processed events"
         if not self.active():
             raise pygame.error("PyGame object is no longer active")
-        for event in pygame.event.get():
+        for event in self._event_source():
+            if self._recorder is not None:
+                self._recorder.event(self._frame, event)
             yield event
 
     def bind_on_event(self, evt, func):
@@ -294,10 +333,11 @@ class PyGame(object):
                 fn(self, event)
             if event.type == pyl.QUIT:
                 self.deactivate()
-            elif event.type == pyl.KEYDOWN and self.get_keydown(pyl.K_ESCAPE):
+            elif event.type == pyl.KEYDOWN and event.key == pyl.K_ESCAPE:
                 self.deactivate()
         if render and self.active():
             self.render_end()
+        self._frame += 1
 
 if __name__ == "__main__":
     # for testing
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+Input event recording and replay
+
+A recording is a file of JSON lines:
+    {"version": 1, "seed": int, "argv": [...]}      header, always first
+    {"frame": int, "t": float, "type": int, "attrs": {...}}
+                                                    one per event dispatched
+    {"stimuli": [path, ...]}                        images in the order shown
+
+frame counts calls to PyGame.run_once and t is the number of seconds since
+the recording began, taken from a monotonic clock.
+"""
+
+import json
+import time
+
+import pygame
+
+RECORD_VERSION = 1
+
+_monotonic = getattr(time, 'monotonic', time.time)
+_ATTR_TYPES = (bool, int, float, type(u''), str)
+
+def _event_attrs(event):
+    "returns the JSON-serializable attributes of a pygame event"
+    attrs = {}
+    for k, v in event.dict.items():
+        if isinstance(v, _ATTR_TYPES):
+            attrs[k] = v
+        elif isinstance(v, (tuple, list)) and all(isinstance(i, _ATTR_TYPES) for i in v):
+            attrs[k] = list(v)
+    return attrs
+
+class EventRecorder(object):
+    def __init__(self, path, seed, argv=()):
+        self._fobj = open(path, 'w')
+        self._start = _monotonic()
+        self._write({'version': RECORD_VERSION, 'seed': seed, 'argv': list(argv)})
+
+    def _write(self, obj):
+        json.dump(obj, self._fobj)
+        self._fobj.write("\n")
+
+    def event(self, frame, event):
+        "record `event`, dispatched during the given frame"
+        self._write({
+            'frame': frame,
+            't': _monotonic() - self._start,
+            'type': event.type,
+            'attrs': _event_attrs(event),
+        })
+
+    def stimuli(self, paths):
+        self._write({'stimuli': list(paths)})
+
+    def close(self):
+        if self._fobj is not None:
+            self._fobj.close()
+            self._fobj = None
+
+class EventReplay(object):
+    """Feeds a recording back to PyGame.set_event_source.
+
+    By default the events of each recorded frame are returned on successive
+    calls, with no waiting, so the session replays as fast as possible. With
+    realtime=True events are held back until their recorded time. Once the
+    recording is exhausted a QUIT event is returned."""
+    def __init__(self, path, realtime=False):
+        self._realtime = realtime
+        self._header = None
+        self._events = []
+        self._stimuli = None
+        with open(path) as fobj:
+            for line in fobj:
+                rec = json.loads(line)
+                if self._header is None:
+                    if rec.get('version') != RECORD_VERSION:
+                        raise ValueError("%s: unsupported recording version %r"
+                                         % (path, rec.get('version')))
+                    self._header = rec
+                elif 'stimuli' in rec:
+                    self._stimuli = rec['stimuli']
+                else:
+                    self._events.append(rec)
+        if self._header is None:
+            raise ValueError("%s: empty recording" % (path,))
+        self._pos = 0
+        self._start = None
+
+    def seed(self):
+        return self._header['seed']
+
+    def argv(self):
+        return self._header['argv']
+
+    def stimuli(self):
+        "the recorded stimulus sequence, or None if it was not recorded"
+        return self._stimuli
+
+    def num_events(self):
+        return len(self._events)
+
+    def done(self):
+        return self._pos >= len(self._events)
+
+    def get_events(self):
+        if self._start is None:
+            self._start = _monotonic()
+        if self.done():
+            return [pygame.event.Event(pygame.QUIT)]
+        if self._realtime:
+            elapsed = _monotonic() - self._start
+            due = self._events[self._pos]['t'] - elapsed
+            if due > 0:
+                time.sleep(min(due, 0.01))
+                return []
+            last = len(self._events)
+            end = self._pos
+            while end < last and self._events[end]['t'] <= elapsed:
+                end += 1
+        else:
+            frame = self._events[self._pos]['frame']
+            end = self._pos
+            while end < len(self._events) and self._events[end]['frame'] == frame:
+                end += 1
+        batch = self._events[self._pos:end]
+        self._pos = end
+        return [pygame.event.Event(rec['type'], rec['attrs']) for rec in batch]
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""
+Time-indexed segment files
+
+Compacting a results log moves its runs into immutable, gzip-compressed
+segment files, one or more per month, named YYYY-MM.N.seg.gz. The first line
+of a segment is a JSON header:
+    segment:    format version
+    month:      "YYYY-MM" of the runs' start times (local time)
+    start:      earliest start_time in the segment
+    end:        latest start_time in the segment
+    runs:       number of runs
+    summary:    precomputed aggregates of every run (see analysis.Summary)
+and every following line is a run exactly as it appeared in the log.
+"""
+
+import datetime
+import gzip
+import json
+import os
+
+SEGMENT_VERSION = 1
+SEGMENT_SUFFIX = '.seg.gz'
+
+def month_of(ts):
+    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m")
+
+def segment_paths(dirname, since=None, until=None):
+    """returns the segment files in `dirname`, oldest month first, leaving
+    out by the month in their names those holding no runs started in
+    [since, until)"""
+    names = [n for n in os.listdir(dirname) if n.endswith(SEGMENT_SUFFIX)]
+    def key(name):
+        month, seq = name[:-len(SEGMENT_SUFFIX)].rsplit('.', 1)
+        return month, int(seq)
+    first = month_of(since) if since is not None else None
+    # until is exclusive: the last month is that of the microsecond before
+    last = month_of(until - 1e-6) if until is not None else None
+    paths = []
+    for name in sorted(names, key=key):
+        month = key(name)[0]
+        if (first is None or month >= first) and (last is None or month <= last):
+            paths.append(os.path.join(dirname, name))
+    return paths
+
+def overlapping_groups(dirname, since=None, until=None):
+    """returns lists of (path, header) of the segments in `dirname` that may
+    hold runs started in [since, until), ordered by start time and grouped so
+    that segments with overlapping time ranges share a group"""
+    found = []
+    for path in segment_paths(dirname, since, until):
+        header = read_header(path)
+        if overlaps(header, since, until):
+            found.append((header['start'], header['end'], path, header))
+    found.sort(key=lambda f: (f[0], f[1]))
+    groups = []
+    group_end = None
+    for start, end, path, header in found:
+        if groups and start <= group_end:
+            groups[-1].append((path, header))
+            group_end = max(group_end, end)
+        else:
+            groups.append([(path, header)])
+            group_end = end
+    return groups
+
+def read_header(path):
+    "reads only the header of a segment"
+    with gzip.open(path, 'rt') as fobj:
+        header = json.loads(fobj.readline())
+    if header.get('segment') != SEGMENT_VERSION:
+        raise ValueError("%s: unsupported segment version %r" % (
+            path, header.get('segment')))
+    return header
+
+def each_line(path):
+    "yields the run lines of a segment, skipping its header"
+    with gzip.open(path, 'rt') as fobj:
+        fobj.readline()
+        for line in fobj:
+            l = line.strip()
+            if l:
+                yield l
+
+def overlaps(header, since=None, until=None):
+    "True if a segment may hold runs started in [since, until)"
+    if since is not None and header['end'] < since:
+        return False
+    if until is not None and header['start'] >= until:
+        return False
+    return True
+
+def within(header, since=None, until=None):
+    "True if every run of a segment started in [since, until)"
+    if since is not None and header['start'] < since:
+        return False
+    if until is not None and header['end'] >= until:
+        return False
+    return True
+
+def write_segment(dirname, month, header, body_path):
+    """writes a new segment for `month` to `dirname` from `header` and the
+    run lines in the file `body_path`, never replacing an existing segment;
+    returns the path written"""
+    seq = 1
+    while os.path.exists(os.path.join(dirname, "%s.%d%s" % (
+            month, seq, SEGMENT_SUFFIX))):
+        seq += 1
+    path = os.path.join(dirname, "%s.%d%s" % (month, seq, SEGMENT_SUFFIX))
+    header = dict(header, segment=SEGMENT_VERSION, month=month)
+    tmp = path + '.tmp'
+    with gzip.open(tmp, 'wt') as out:
+        json.dump(header, out)
+        out.write("\n")
+        with open(body_path) as body:
+            for line in body:
+                out.write(line)
+    os.rename(tmp, path)
+    return path
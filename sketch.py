@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""
+Bounded-memory summaries of reaction times
+
+QuantileSketch:
+    mergeable log-bucketed quantile sketch (in the style of DDSketch); every
+    quantile reported is within a relative error of `accuracy` (default 1%)
+    of a true value at that rank, using at most `max_bins` counters
+Histogram:
+    mergeable fixed-width histogram over [lo, hi) with under/overflow counts
+TimeDistribution:
+    a QuantileSketch and a Histogram fed from the same values
+
+All three serialize to and from plain dicts suitable for json.dump.
+"""
+
+import math
+
+class QuantileSketch(object):
+    def __init__(self, accuracy=0.01, max_bins=2048, min_value=1e-6):
+        if not 0 < accuracy < 1:
+            raise ValueError("accuracy must be in (0, 1)")
+        if max_bins < 1:
+            raise ValueError("max_bins must be at least 1")
+        self._accuracy = accuracy
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._max_bins = max_bins
+        self._min_value = min_value
+        self._bins = {}
+        self._zeros = 0
+        self._count = 0
+        self._sum = 0.0
+        self._min = None
+        self._max = None
+
+    def accuracy(self):
+        return self._accuracy
+
+    def count(self):
+        return self._count
+
+    def total(self):
+        return self._sum
+
+    def mean(self):
+        if self._count == 0:
+            return float('nan')
+        return self._sum / self._count
+
+    def add(self, value, weight=1):
+        if value < 0:
+            raise ValueError("cannot add negative value %r" % (value,))
+        if value <= self._min_value:
+            self._zeros += weight
+        else:
+            key = int(math.ceil(math.log(value) / self._log_gamma))
+            self._bins[key] = self._bins.get(key, 0) + weight
+            if len(self._bins) > self._max_bins:
+                self._collapse()
+        self._count += weight
+        self._sum += value * weight
+        self._min = value if self._min is None else min(self._min, value)
+        self._max = value if self._max is None else max(self._max, value)
+
+    def _collapse(self):
+        "folds the lowest bins together until at most max_bins remain"
+        keys = sorted(self._bins)
+        extra = len(keys) - self._max_bins
+        for key in keys[:extra]:
+            self._bins[keys[extra]] += self._bins.pop(key)
+
+    def merge(self, other):
+        if (other._accuracy, other._min_value) != (self._accuracy, self._min_value):
+            raise ValueError("cannot merge sketches with different parameters")
+        for key, n in other._bins.items():
+            self._bins[key] = self._bins.get(key, 0) + n
+        if len(self._bins) > self._max_bins:
+            self._collapse()
+        self._zeros += other._zeros
+        self._count += other._count
+        self._sum += other._sum
+        for v in (other._min, other._max):
+            if v is not None:
+                self._min = v if self._min is None else min(self._min, v)
+                self._max = v if self._max is None else max(self._max, v)
+        return self
+
+    def quantile(self, q):
+        "value at quantile `q` in [0, 1] (nan if empty)"
+        if not 0 <= q <= 1:
+            raise ValueError("quantile must be in [0, 1]")
+        if self._count == 0:
+            return float('nan')
+        rank = q * (self._count - 1)
+        seen = self._zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self._bins):
+            seen += self._bins[key]
+            if seen > rank:
+                value = 2 * self._gamma ** key / (self._gamma + 1)
+                return min(max(value, self._min), self._max)
+        return self._max
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def to_dict(self):
+        return {
+            'accuracy': self._accuracy,
+            'max_bins': self._max_bins,
+            'min_value': self._min_value,
+            'count': self._count,
+            'sum': self._sum,
+            'min': self._min,
+            'max': self._max,
+            'zeros': self._zeros,
+            'bins': sorted(self._bins.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        sk = cls(d['accuracy'], d['max_bins'], d['min_value'])
+        sk._bins = dict((int(k), n) for k, n in d['bins'])
+        sk._zeros = d['zeros']
+        sk._count = d['count']
+        sk._sum = d['sum']
+        sk._min = d['min']
+        sk._max = d['max']
+        return sk
+
+class Histogram(object):
+    def __init__(self, lo=0.0, hi=5.0, bins=25):
+        if hi <= lo or bins < 1:
+            raise ValueError("need lo < hi and at least one bin")
+        self._lo = lo
+        self._hi = hi
+        self._width = (hi - lo) * 1.0 / bins
+        self._counts = [0] * bins
+        self._under = 0
+        self._over = 0
+
+    def add(self, value, weight=1):
+        if value < self._lo:
+            self._under += weight
+        elif value >= self._hi:
+            self._over += weight
+        else:
+            idx = min(int((value - self._lo) / self._width), len(self._counts) - 1)
+            self._counts[idx] += weight
+
+    def merge(self, other):
+        if (other._lo, other._hi, len(other._counts)) != \
+                (self._lo, self._hi, len(self._counts)):
+            raise ValueError("cannot merge histograms with different bins")
+        self._counts = [a + b for a, b in zip(self._counts, other._counts)]
+        self._under += other._under
+        self._over += other._over
+        return self
+
+    def edges(self):
+        return [self._lo + i * self._width for i in range(len(self._counts) + 1)]
+
+    def counts(self):
+        return self._counts[:]
+
+    def underflow(self):
+        return self._under
+
+    def overflow(self):
+        return self._over
+
+    def format(self, width=40):
+        "returns the histogram as lines of text bars"
+        peak = max(self._counts + [self._under, self._over, 1])
+        rows = []
+        if self._under:
+            rows.append(("< %.2f" % (self._lo,), self._under))
+        edges = self.edges()
+        for i, n in enumerate(self._counts):
+            rows.append(("%.2f-%.2f" % (edges[i], edges[i+1]), n))
+        if self._over:
+            rows.append((">= %.2f" % (self._hi,), self._over))
+        return ["%12s |%-*s %d" % (label, width, '#' * (n * width // peak), n)
+                for label, n in rows]
+
+    def to_dict(self):
+        return {
+            'lo': self._lo,
+            'hi': self._hi,
+            'counts': self._counts,
+            'underflow': self._under,
+            'overflow': self._over,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(d['lo'], d['hi'], len(d['counts']))
+        h._counts = list(d['counts'])
+        h._under = d['underflow']
+        h._over = d['overflow']
+        return h
+
+class TimeDistribution(object):
+    def __init__(self, sketch=None, histogram=None):
+        self.sketch = sketch if sketch is not None else QuantileSketch()
+        self.histogram = histogram if histogram is not None else Histogram()
+
+    def add(self, value):
+        self.sketch.add(value)
+        self.histogram.add(value)
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        self.histogram.merge(other.histogram)
+        return self
+
+    def to_dict(self):
+        return {
+            'sketch': self.sketch.to_dict(),
+            'histogram': self.histogram.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(QuantileSketch.from_dict(d['sketch']),
+                   Histogram.from_dict(d['histogram']))